@@ -3,7 +3,11 @@ Manufacturing Quote Assistant - Streamlit Application
 A comprehensive AI-powered tool for analyzing manufacturing quotes and documents.
 """
 
+import io
 import os
+import platform
+import posixpath
+import re
 import streamlit as st
 import sys
 
@@ -40,51 +44,56 @@ except ImportError as e:
         pass
     st.stop()
 
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
 from datetime import datetime
-from typing import Dict, Any, List, Optional
-import pandas as pd
+import hashlib
+import importlib.util
+import threading
+from typing import Dict, Any, List, Optional, Tuple
 from pathlib import Path
 import json
-import tempfile
 import zipfile
 
-# Document processing imports
-try:
-    import fitz  # PyMuPDF
-except ImportError:
+def _module_available(name: str) -> bool:
+    """Check whether a module is installed without importing it (dotted names import only the parents)"""
+    try:
+        return importlib.util.find_spec(name) is not None
+    except (ImportError, ValueError):
+        return False
+
+# Document processing and generation modules are imported on first use;
+# only check that they are installed here
+if not _module_available("fitz"):
     st.error("PyMuPDF not found. Please install: pip install PyMuPDF")
     st.stop()
 
-try:
-    from docx import Document
-except ImportError:
+if not _module_available("docx") or not _module_available("lxml"):
     st.error("python-docx not found. Please install: pip install python-docx")
     st.stop()
 
-try:
-    import openpyxl
-except ImportError:
+if not _module_available("openpyxl"):
     st.error("openpyxl not found. Please install: pip install openpyxl")
     st.stop()
 
-# Document generation
-from docx import Document as DocxDocument
-from docx.shared import Inches
-from docx.enum.text import WD_ALIGN_PARAGRAPH
+if not _module_available("numpy"):
+    st.error("numpy not found. Please install: pip install numpy")
+    st.stop()
 
-# Vector store and embeddings (optional for RAG)
-try:
-    from langchain.embeddings import HuggingFaceEmbeddings
-    from langchain.vectorstores import FAISS
-    from langchain.text_splitter import RecursiveCharacterTextSplitter
-    from langchain.chains import ConversationalRetrievalChain
-    from langchain.llms.base import LLM
-    from langchain.schema import BaseMessage
-    RAG_AVAILABLE = True
-    st.sidebar.success("✅ RAG components loaded")
-except ImportError as e:
-    RAG_AVAILABLE = False
-    st.sidebar.warning(f"⚠️ RAG not available: {e}")
+# Vector store and embeddings (optional for RAG), imported when RAG is first set up
+# Check the submodules actually imported: newer langchain releases drop these paths,
+# and from 0.1 on they re-export from langchain_community
+RAG_MODULES = (
+    "langchain.embeddings", "langchain.vectorstores", "langchain.text_splitter",
+    "langchain.docstore.document", "langchain.docstore.in_memory",
+    "langchain_community", "faiss", "sentence_transformers", "diskcache"
+)
+_missing_rag_modules = [name for name in RAG_MODULES if not _module_available(name)]
+RAG_AVAILABLE = not _missing_rag_modules
+if RAG_AVAILABLE:
+    st.sidebar.success("✅ RAG components available")
+else:
+    st.sidebar.warning(f"⚠️ RAG not available: missing {', '.join(_missing_rag_modules)}")
     st.sidebar.info("Basic functionality will work without RAG")
 
 # Configure Streamlit page
@@ -97,17 +106,270 @@ st.set_page_config(
 
 # Constants
 SUPPORTED_FILE_TYPES = ["pdf", "docx", "xlsx", "txt"]
+MAX_EXTRACTION_WORKERS = 8
+MAX_CONCURRENT_ANALYSES = 5
+MAX_TEXT_CACHE_ENTRIES = 256
+MAX_PROMPT_CHARS = 60000
 OUTPUT_DIR = Path("processed_files")
 OUTPUT_DIR.mkdir(exist_ok=True)
+EMBEDDING_CACHE_PATH = OUTPUT_DIR / "embeddings"
+# Upper bound on the on-disk embedding cache; least recently used vectors are evicted
+EMBEDDING_CACHE_SIZE_LIMIT = 128 * 1024 ** 2
+EMBEDDING_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+MODEL_DIR = OUTPUT_DIR / "models"
+QUANTIZED_WEIGHT_DTYPES = {"avx2": "quint8", "arm64": "qint8"}
+# Debug aid: also keep a copy of generated reports in OUTPUT_DIR
+SAVE_REPORTS_TO_DISK = os.getenv("SAVE_REPORTS_TO_DISK", "").lower() in ("1", "true", "yes")
+NUMPY_SEARCH_MAX_CHUNKS = 5000
+EMBEDDING_BATCH_SIZE = 64
+HNSW_NEIGHBORS = 32
+HNSW_EF_CONSTRUCTION = 80
+HNSW_EF_SEARCH = 64
+
+# Section headers expected in the AI analysis output, matched in a single regex pass
+ANALYSIS_SECTIONS = (
+    "CRD Data Summary",
+    "Manufacturing Feasibility Assessment",
+    "Material & Component Sourcing Requirements",
+    "Missing Critical Information",
+    "Comparison Baseline Data",
+    "Risk Factors & Special Requirements"
+)
+SECTION_HEADER_RE = re.compile("|".join(re.escape(name) for name in ANALYSIS_SECTIONS), re.IGNORECASE)
+SECTION_BY_LOWER = {name.lower(): name for name in ANALYSIS_SECTIONS}
+
+# Whitespace normalisation applied to document text before prompting
+TRAILING_WHITESPACE_RE = re.compile(r"[ \t]+\n")
+BLANK_LINES_RE = re.compile(r"\n{3,}")
+TRUNCATION_MARKER = "\n...[truncated]...\n"
+
+# WordprocessingML tags read when streaming DOCX text
+DOCX_NAMESPACE = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+DOCX_PARAGRAPH_TAG = DOCX_NAMESPACE + "p"
+DOCX_RUN_TAG = DOCX_NAMESPACE + "r"
+DOCX_TEXT_TAG = DOCX_NAMESPACE + "t"
+DOCX_TAB_TAG = DOCX_NAMESPACE + "tab"
+DOCX_BREAK_TAG = DOCX_NAMESPACE + "br"
+DOCX_CARRIAGE_RETURN_TAG = DOCX_NAMESPACE + "cr"
+DOCX_BREAK_TYPE_ATTR = DOCX_NAMESPACE + "type"
+# Alternate renderings of the same content (e.g. text boxes); only mc:Choice is read
+DOCX_FALLBACK_TAG = "{http://schemas.openxmlformats.org/markup-compatibility/2006}Fallback"
+# Package relationships locate the main document part, which need not be word/document.xml
+PACKAGE_RELS_PART = "_rels/.rels"
+PACKAGE_RELATIONSHIP_TAG = "{http://schemas.openxmlformats.org/package/2006/relationships}Relationship"
+
+# Critical quote inputs looked for in the "Missing Critical Information" section
+CRITICAL_MISSING_ITEMS = (
+    "quantity", "material grade", "delivery", "bom",
+    "specifications", "tolerance", "dimensions", "process"
+)
+CRITICAL_MISSING_RE = re.compile("|".join(re.escape(item) for item in CRITICAL_MISSING_ITEMS), re.IGNORECASE)
+
+# Text fields of an analysis dict; everything else is a per-file scalar
+ANALYSIS_TEXT_FIELDS = (
+    'crd_summary', 'feasibility_assessment', 'sourcing_requirements',
+    'missing_info', 'baseline_data', 'risk_factors', 'full_text'
+)
+
+@dataclass
+class AnalysisResult:
+    """Scalar fields of a single file's analysis"""
+    __slots__ = ('file_name', 'quote_ready', 'risk_score', 'generated_at')
+    
+    file_name: str
+    quote_ready: bool
+    risk_score: int
+    generated_at: str
+    
+    @classmethod
+    def from_dict(cls, analysis: Dict[str, Any]) -> "AnalysisResult":
+        """Build from an analysis dict as produced by the parser"""
+        return cls(
+            file_name=analysis['file_name'],
+            quote_ready=analysis['quote_ready'],
+            risk_score=analysis['risk_score'],
+            generated_at=analysis['generated_at']
+        )
+    
+    def to_dict(self, text_fields: Dict[str, str]) -> Dict[str, Any]:
+        """Recombine with the file's text fields into an analysis dict"""
+        return {
+            'file_name': self.file_name,
+            **text_fields,
+            'quote_ready': self.quote_ready,
+            'risk_score': self.risk_score,
+            'generated_at': self.generated_at
+        }
+
+class AnalysisBatch:
+    """Analyses of several files stored as parallel arrays for vectorized summaries"""
+    
+    def __init__(self, analyses: List[Dict[str, Any]]):
+        """Split analysis dicts into scalar results, text fields and NumPy columns"""
+        import numpy as np
+        
+        self.results = [AnalysisResult.from_dict(analysis) for analysis in analyses]
+        self.text_fields = [
+            {field: analysis[field] for field in ANALYSIS_TEXT_FIELDS}
+            for analysis in analyses
+        ]
+        self.risk_scores = np.array([result.risk_score for result in self.results], dtype=float)
+        self.quote_ready = np.array([result.quote_ready for result in self.results], dtype=bool)
+    
+    def __len__(self) -> int:
+        return len(self.results)
+    
+    @property
+    def quote_ready_count(self) -> int:
+        """Number of files that are ready to quote"""
+        return int(self.quote_ready.sum())
+    
+    @property
+    def avg_risk_score(self) -> float:
+        """Mean risk score across files"""
+        return float(self.risk_scores.mean())
+    
+    def to_dicts(self) -> List[Dict[str, Any]]:
+        """Analysis dicts in the original per-file layout"""
+        return [
+            result.to_dict(text_fields)
+            for result, text_fields in zip(self.results, self.text_fields)
+        ]
+
+def _embedding_batch_size() -> int:
+    """Pick an encoder batch size that fits in available memory"""
+    try:
+        import psutil
+    except ImportError:
+        return EMBEDDING_BATCH_SIZE
+    
+    available_gb = psutil.virtual_memory().available / 1024 ** 3
+    if available_gb < 1:
+        return EMBEDDING_BATCH_SIZE // 4
+    if available_gb < 2:
+        return EMBEDDING_BATCH_SIZE // 2
+    return EMBEDDING_BATCH_SIZE
+
+if RAG_AVAILABLE:
+    class QuantizedEmbeddings:
+        """LangChain-compatible embeddings backed by an int8-quantized ONNX sentence-transformers model"""
+        
+        def __init__(self, model_name: str = EMBEDDING_MODEL_NAME, cache_dir: Path = MODEL_DIR):
+            """Load the quantized model, exporting it once into cache_dir if needed"""
+            from sentence_transformers import SentenceTransformer, export_dynamic_quantized_onnx_model
+            
+            arch = "arm64" if platform.machine().lower() in ("arm64", "aarch64") else "avx2"
+            # The avx2 preset quantizes weights to QUInt8, arm64 to QInt8
+            file_suffix = f"{QUANTIZED_WEIGHT_DTYPES[arch]}_{arch}"
+            model_path = cache_dir / model_name.split("/")[-1]
+            quantized_file = f"onnx/model_{file_suffix}.onnx"
+            
+            if not (model_path / quantized_file).exists():
+                model = SentenceTransformer(model_name, backend="onnx")
+                model.save(str(model_path))
+                export_dynamic_quantized_onnx_model(model, arch, str(model_path), file_suffix=file_suffix)
+            
+            self.model = SentenceTransformer(
+                str(model_path),
+                backend="onnx",
+                model_kwargs={"file_name": quantized_file}
+            )
+            self.model_id = f"{model_name}:{quantized_file}"
+        
+        def embed_documents(self, texts: List[str]) -> List[List[float]]:
+            """Embed all document chunks in one batched, normalised encoder call"""
+            return self.model.encode(
+                texts,
+                batch_size=_embedding_batch_size(),
+                show_progress_bar=False,
+                normalize_embeddings=True,
+                convert_to_numpy=True
+            ).tolist()
+        
+        def embed_query(self, text: str) -> List[float]:
+            """Embed a single query"""
+            return self.model.encode(text, convert_to_numpy=True).tolist()
+
+@st.cache_resource(show_spinner=False)
+def _load_gemini_model(api_key: str):
+    """Configure Gemini and build the model once per server process"""
+    genai.configure(api_key=api_key)
+    return genai.GenerativeModel('gemini-1.5-flash')
+
+@st.cache_resource(show_spinner=False)
+def _load_embeddings() -> Tuple[Any, str, Optional[str]]:
+    """Load the embedding model once per server process.
+    
+    Returns (embeddings, model_id, fallback_reason); fallback_reason is set when
+    the quantized model could not be loaded and full precision is used instead.
+    """
+    try:
+        embeddings = QuantizedEmbeddings()
+        return embeddings, embeddings.model_id, None
+    except Exception as e:
+        from langchain.embeddings import HuggingFaceEmbeddings
+        
+        embeddings = HuggingFaceEmbeddings(
+            model_name=EMBEDDING_MODEL_NAME,
+            encode_kwargs={"batch_size": _embedding_batch_size(), "normalize_embeddings": True}
+        )
+        return embeddings, EMBEDDING_MODEL_NAME, str(e)
+
+@st.cache_resource(show_spinner=False)
+def _load_text_splitter():
+    """Build the RAG text splitter once per server process"""
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    
+    return RecursiveCharacterTextSplitter(
+        chunk_size=1000,
+        chunk_overlap=200
+    )
+
+@st.cache_resource(show_spinner=False)
+def _load_text_cache() -> Tuple[Dict[str, str], threading.Lock]:
+    """Extracted-text cache shared by all sessions, keyed by file content hash"""
+    return {}, threading.Lock()
+
+@st.cache_resource(show_spinner=False)
+def _load_embedding_cache():
+    """Open the size-bounded on-disk embedding cache once per server process.
+    
+    diskcache is safe for concurrent use from the threads Streamlit runs sessions on.
+    """
+    import diskcache
+    
+    # Remove the unbounded shelve files written by earlier versions
+    for stale_file in OUTPUT_DIR.glob("embedding_cache*"):
+        if stale_file.is_file():
+            stale_file.unlink()
+    
+    return diskcache.Cache(
+        str(EMBEDDING_CACHE_PATH),
+        size_limit=EMBEDDING_CACHE_SIZE_LIMIT,
+        eviction_policy="least-recently-used"
+    )
+
+@st.cache_resource(show_spinner=False)
+def _load_pdf_lock() -> threading.Lock:
+    """Process-wide lock serialising PyMuPDF calls, which are not thread-safe"""
+    return threading.Lock()
 
 class ManufacturingQuoteAssistant:
     """Main application class for the Manufacturing Quote Assistant"""
     
     def __init__(self):
         """Initialize the application"""
+        # Content-hash caches so re-uploaded documents skip parsing and AI analysis
+        self._text_cache, self._text_cache_lock = _load_text_cache()
+        self._analysis_cache: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self._cache_lock = threading.Lock()
+        
+        # RAG models are loaded on first use so sessions that never chat skip them
+        self._rag_ready = False
+        self.vector_store = None
+        self._chunk_matrix = None
+        self._chunks: List[str] = []
         self.setup_api()
-        if RAG_AVAILABLE:
-            self.setup_rag()
         
     def setup_api(self):
         """Setup Google AI API"""
@@ -125,8 +387,7 @@ class ManufacturingQuoteAssistant:
             st.stop()
         
         try:
-            genai.configure(api_key=api_key)
-            self.model = genai.GenerativeModel('gemini-1.5-flash')
+            self.model = _load_gemini_model(api_key)
             st.success("AI Model initialized successfully")
         except Exception as e:
             st.error(f"Failed to initialize AI model: {e}")
@@ -134,110 +395,265 @@ class ManufacturingQuoteAssistant:
     
     def setup_rag(self):
         """Setup RAG components if available"""
+        global RAG_AVAILABLE
         if not RAG_AVAILABLE:
             return
             
         try:
-            self.embeddings = HuggingFaceEmbeddings(
-                model_name="sentence-transformers/all-MiniLM-L6-v2"
-            )
-            self.text_splitter = RecursiveCharacterTextSplitter(
-                chunk_size=1000,
-                chunk_overlap=200
-            )
-            self.vector_store = None
+            self.embeddings, self.embedding_model_id, fallback_reason = _load_embeddings()
+            if fallback_reason:
+                st.sidebar.info(f"Quantized embeddings unavailable, using full-precision model: {fallback_reason}")
+            self.text_splitter = _load_text_splitter()
+            self._rag_ready = True
             st.info("RAG capabilities enabled")
         except Exception as e:
             st.warning(f"RAG setup failed: {e}")
             RAG_AVAILABLE = False
     
-    def extract_text_from_file(self, uploaded_file) -> str:
-        """Extract text from uploaded file"""
-        try:
-            file_extension = uploaded_file.name.lower().split('.')[-1]
-            
-            if file_extension == "pdf":
-                return self._extract_pdf_text(uploaded_file)
-            elif file_extension == "docx":
-                return self._extract_docx_text(uploaded_file)
-            elif file_extension == "xlsx":
-                return self._extract_xlsx_text(uploaded_file)
-            elif file_extension == "txt":
-                return str(uploaded_file.read(), "utf-8")
-            else:
-                st.error(f"Unsupported file type: {file_extension}")
-                return ""
-                
-        except Exception as e:
-            st.error(f"Error extracting text from {uploaded_file.name}: {e}")
-            return ""
+    def _ensure_rag(self) -> bool:
+        """Load RAG components on first use; returns whether RAG is usable"""
+        if not self._rag_ready:
+            self.setup_rag()
+        return self._rag_ready
     
-    def _extract_pdf_text(self, uploaded_file) -> str:
-        """Extract text from PDF file"""
-        text = ""
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp_file:
-            tmp_file.write(uploaded_file.read())
-            tmp_file.flush()
-            
-            doc = fitz.open(tmp_file.name)
-            for page in doc:
-                text += page.get_text()
-            doc.close()
-            
-        os.unlink(tmp_file.name)
+    def _extract_text(self, uploaded_file) -> str:
+        """Extract text from uploaded file without touching the Streamlit UI"""
+        # getvalue() returns the buffered upload without consuming the stream,
+        # so reruns and repeated extraction never see an exhausted file
+        data = uploaded_file.getvalue()
+        digest = hashlib.sha256(data).hexdigest()
+        with self._text_cache_lock:
+            cached = self._text_cache.get(digest)
+        if cached is not None:
+            return cached
+        
+        text = self._extract_text_uncached(uploaded_file.name, data)
+        with self._text_cache_lock:
+            # Evict the oldest entry so the shared cache stays bounded
+            if len(self._text_cache) >= MAX_TEXT_CACHE_ENTRIES:
+                self._text_cache.pop(next(iter(self._text_cache)))
+            self._text_cache[digest] = text
         return text
     
-    def _extract_docx_text(self, uploaded_file) -> str:
+    def _extract_text_uncached(self, filename: str, data: bytes) -> str:
+        """Dispatch text extraction on the file extension"""
+        file_extension = filename.lower().split('.')[-1]
+        
+        if file_extension == "pdf":
+            return self._extract_pdf_text(data)
+        elif file_extension == "docx":
+            return self._extract_docx_text(data)
+        elif file_extension == "xlsx":
+            return self._extract_xlsx_text(data)
+        elif file_extension == "txt":
+            return data.decode("utf-8", errors="replace")
+        else:
+            raise ValueError(f"Unsupported file type: {file_extension}")
+    
+    def _extract_pdf_text(self, data: bytes) -> str:
+        """Extract text from PDF file"""
+        import fitz  # PyMuPDF
+        
+        # Files are extracted on worker threads, but MuPDF's context is global
+        with _load_pdf_lock():
+            doc = fitz.open(stream=data, filetype="pdf")
+            try:
+                return "".join(page.get_text() for page in doc)
+            finally:
+                doc.close()
+    
+    def _extract_docx_text(self, data: bytes) -> str:
         """Extract text from DOCX file"""
-        doc = Document(uploaded_file)
-        text = "\n".join([paragraph.text for paragraph in doc.paragraphs])
-        return text
+        from lxml import etree  # installed as a python-docx dependency
+        
+        # Stream the main document part rather than building the python-docx object model.
+        # Uploads are untrusted: never resolve entities or fetch anything over the network.
+        paragraphs = []
+        fallback_depth = 0
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            with archive.open(self._docx_main_part(archive)) as xml_file:
+                events = etree.iterparse(
+                    xml_file,
+                    events=("start", "end"),
+                    tag=(DOCX_PARAGRAPH_TAG, DOCX_FALLBACK_TAG),
+                    resolve_entities=False,
+                    no_network=True
+                )
+                for event, element in events:
+                    if element.tag == DOCX_FALLBACK_TAG:
+                        if event == "start":
+                            fallback_depth += 1
+                        else:
+                            fallback_depth -= 1
+                            element.clear()
+                    elif event == "end":
+                        if not fallback_depth:
+                            paragraphs.append(self._docx_paragraph_text(element))
+                        # Clearing also stops nested paragraphs being counted twice
+                        element.clear()
+        return "\n".join(paragraphs)
     
-    def _extract_xlsx_text(self, uploaded_file) -> str:
+    def _docx_main_part(self, archive: zipfile.ZipFile) -> str:
+        """Find the main document part via the package's officeDocument relationship"""
+        from lxml import etree
+        
+        parser = etree.XMLParser(resolve_entities=False, no_network=True)
+        rels = etree.fromstring(archive.read(PACKAGE_RELS_PART), parser)
+        for relationship in rels.iter(PACKAGE_RELATIONSHIP_TAG):
+            if (relationship.get("Type", "").endswith("/officeDocument")
+                    and relationship.get("TargetMode") != "External"):
+                return posixpath.normpath(relationship.get("Target", "").lstrip("/"))
+        raise ValueError("DOCX package has no main document part")
+    
+    def _docx_paragraph_text(self, paragraph) -> str:
+        """Text of a <w:p> element, rendering tabs and line breaks like python-docx"""
+        parts = []
+        for node in paragraph.iter(DOCX_TEXT_TAG, DOCX_TAB_TAG, DOCX_BREAK_TAG, DOCX_CARRIAGE_RETURN_TAG):
+            if node.tag == DOCX_TEXT_TAG:
+                # Unresolved entity references are child nodes; keep the text around them
+                parts.append((node.text or "") + "".join(child.tail or "" for child in node))
+            elif node.getparent().tag != DOCX_RUN_TAG:
+                continue  # e.g. tab stop definitions in paragraph properties
+            elif node.tag == DOCX_TAB_TAG:
+                parts.append("\t")
+            elif node.tag == DOCX_CARRIAGE_RETURN_TAG:
+                parts.append("\n")
+            elif node.get(DOCX_BREAK_TYPE_ATTR, "textWrapping") == "textWrapping":
+                parts.append("\n")
+        return "".join(parts)
+    
+    def _extract_xlsx_text(self, data: bytes) -> str:
         """Extract text from XLSX file"""
-        workbook = openpyxl.load_workbook(uploaded_file)
-        text = ""
+        import openpyxl
         
-        for sheet_name in workbook.sheetnames:
-            sheet = workbook[sheet_name]
-            text += f"\n--- Sheet: {sheet_name} ---\n"
-            
-            for row in sheet.iter_rows():
-                row_text = []
-                for cell in row:
-                    if cell.value is not None:
-                        row_text.append(str(cell.value))
-                if row_text:
-                    text += " | ".join(row_text) + "\n"
+        workbook = openpyxl.load_workbook(io.BytesIO(data), read_only=True, data_only=True)
+        parts = []
         
-        return text
+        try:
+            for sheet_name in workbook.sheetnames:
+                sheet = workbook[sheet_name]
+                # Read-only mode trusts the stored <dimension>, which many writers get wrong
+                sheet.reset_dimensions()
+                parts.append(f"\n--- Sheet: {sheet_name} ---")
+                
+                for row in sheet.iter_rows(values_only=True):
+                    row_text = " | ".join(str(value) for value in row if value is not None)
+                    if row_text:
+                        parts.append(row_text)
+        finally:
+            # Read-only workbooks keep the underlying archive open until closed
+            workbook.close()
+        
+        return "\n".join(parts)
+    
+    def _generate_analysis(self, text: str, filename: str) -> Optional[Dict[str, Any]]:
+        """Run the AI analysis without touching the Streamlit UI.
+        
+        Returns None when the model produced an empty response.
+        Successful analyses are cached by document text hash and filename.
+        """
+        cache_key = self._analysis_cache_key(text, filename)
+        with self._cache_lock:
+            cached = self._analysis_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
+        response = self.model.generate_content(
+            self._build_analysis_prompt(text),
+            generation_config=self._analysis_generation_config()
+        )
+        return self._store_analysis(cache_key, response.text, filename)
+    
+    def _analysis_cache_key(self, text: str, filename: str) -> Tuple[str, str]:
+        """Build the analysis cache key for a document"""
+        return (hashlib.sha256(text.encode("utf-8")).hexdigest(), filename)
+    
+    def _analysis_generation_config(self):
+        """Generation settings used for quote analysis"""
+        return genai.types.GenerationConfig(
+            temperature=0.3,
+            max_output_tokens=4000,
+        )
+    
+    def _store_analysis(self, cache_key: Tuple[str, str], output: str, filename: str) -> Optional[Dict[str, Any]]:
+        """Parse AI output and cache the result; returns None for empty output"""
+        if not output:
+            return None
+        
+        analysis = self._parse_analysis_output(output, filename)
+        with self._cache_lock:
+            self._analysis_cache[cache_key] = analysis
+        return analysis
     
-    def analyze_quote_text(self, text: str, filename: str) -> Dict[str, Any]:
-        """Analyze document text using AI"""
-        prompt = self._build_analysis_prompt(text)
+    def process_files(self, uploaded_files) -> List[Tuple[str, Any]]:
+        """Extract and analyze files concurrently, one result per file in upload order.
+        
+        Streamlit calls are not thread-safe, so each outcome is returned as a
+        (status, payload) tuple and rendered by the caller on the main thread:
+        ("error", message) when extraction fails, ("skip", None) when no text
+        was found, and ("ok" | "analysis_error" | "warning", (text, analysis, message))
+        otherwise.
+        """
+        # Text extraction is file/CPU bound: run it on a thread pool
+        results = [None] * len(uploaded_files)
+        max_workers = min(MAX_EXTRACTION_WORKERS, len(uploaded_files))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(self._extract_for_batch, uploaded_file): i
+                for i, uploaded_file in enumerate(uploaded_files)
+            }
+            for future in as_completed(futures):
+                results[futures[future]] = future.result()
+        
+        # AI analysis is network bound: issue the Gemini calls from a second pool,
+        # capped to stay within the API quota
+        pending = [i for i, (status, _) in enumerate(results) if status == "ok"]
+        if pending:
+            with ThreadPoolExecutor(max_workers=min(MAX_CONCURRENT_ANALYSES, len(pending))) as executor:
+                futures = {
+                    executor.submit(self._analyze_for_batch, results[i][1], uploaded_files[i].name): i
+                    for i in pending
+                }
+                for future in as_completed(futures):
+                    results[futures[future]] = future.result()
         
+        return results
+    
+    def _extract_for_batch(self, uploaded_file) -> Tuple[str, Any]:
+        """Extract text for process_files; safe to run in a worker thread"""
         try:
-            with st.spinner(f"Analyzing {filename}..."):
-                response = self.model.generate_content(
-                    prompt,
-                    generation_config=genai.types.GenerationConfig(
-                        temperature=0.3,
-                        max_output_tokens=4000,
-                    )
-                )
-                
-                if response.text:
-                    return self._parse_analysis_output(response.text, filename)
-                else:
-                    st.warning("AI response was empty")
-                    return self._create_empty_analysis(filename)
-                    
+            text = self._extract_text(uploaded_file)
+        except Exception as e:
+            return ("error", f"Error extracting text from {uploaded_file.name}: {e}")
+        
+        return ("ok", text) if text else ("skip", None)
+    
+    def _analyze_for_batch(self, text: str, filename: str) -> Tuple[str, Any]:
+        """Analyze one document for process_files; safe to run in a worker thread"""
+        try:
+            analysis = self._generate_analysis(text, filename)
         except Exception as e:
-            st.error(f"AI analysis failed for {filename}: {e}")
-            return self._create_empty_analysis(filename)
+            return ("analysis_error", (text, self._create_empty_analysis(filename),
+                                       f"AI analysis failed for {filename}: {e}"))
+        
+        if analysis is None:
+            return ("warning", (text, self._create_empty_analysis(filename),
+                                "AI response was empty"))
+        return ("ok", (text, analysis, None))
+    
+    def _prepare_prompt_text(self, text: str) -> str:
+        """Trim redundant whitespace and clip long documents to head + tail"""
+        text = TRAILING_WHITESPACE_RE.sub("\n", text)
+        text = BLANK_LINES_RE.sub("\n\n", text)
+        
+        if len(text) > MAX_PROMPT_CHARS:
+            half = MAX_PROMPT_CHARS // 2
+            text = text[:half] + TRUNCATION_MARKER + text[-half:]
+        return text
     
     def _build_analysis_prompt(self, text: str) -> str:
         """Build analysis prompt for AI"""
+        text = self._prepare_prompt_text(text)
         return f"""
 You are an expert manufacturing quote assistant focused on the Product Engineering Process.
 
@@ -275,14 +691,7 @@ Document content:
     
     def _parse_analysis_output(self, output: str, filename: str) -> Dict[str, Any]:
         """Parse AI analysis output into structured data"""
-        sections = {
-            "CRD Data Summary": "",
-            "Manufacturing Feasibility Assessment": "",
-            "Material & Component Sourcing Requirements": "",
-            "Missing Critical Information": "",
-            "Comparison Baseline Data": "",
-            "Risk Factors & Special Requirements": ""
-        }
+        section_lines = {name: [] for name in ANALYSIS_SECTIONS}
         
         # Simple section extraction
         current_section = None
@@ -291,15 +700,14 @@ Document content:
         for line in lines:
             line = line.strip()
             
-            # Check if this line is a section header
-            for section_name in sections.keys():
-                if section_name.lower() in line.lower():
-                    current_section = section_name
-                    break
-            
-            # Add content to current section
-            if current_section and line and not any(s.lower() in line.lower() for s in sections.keys()):
-                sections[current_section] += line + "\n"
+            # Header lines switch the current section and are not kept as content
+            match = SECTION_HEADER_RE.search(line)
+            if match:
+                current_section = SECTION_BY_LOWER[match.group(0).lower()]
+            elif current_section and line:
+                section_lines[current_section].append(line)
+        
+        sections = {name: "\n".join(content) for name, content in section_lines.items()}
         
         # Calculate risk assessment
         risk_data = self._assess_risk(sections["Missing Critical Information"])
@@ -320,13 +728,8 @@ Document content:
     
     def _assess_risk(self, missing_info: str) -> Dict[str, Any]:
         """Assess risk based on missing information"""
-        critical_missing = [
-            "quantity", "material grade", "delivery", "bom", 
-            "specifications", "tolerance", "dimensions", "process"
-        ]
-        
-        missing_text_lower = missing_info.lower()
-        missing_count = sum(1 for item in critical_missing if item in missing_text_lower)
+        # Count distinct critical items mentioned, in a single pass over the text
+        missing_count = len({item.lower() for item in CRITICAL_MISSING_RE.findall(missing_info)})
         
         # Calculate risk score
         risk_score = min(20 + (missing_count * 15), 100)
@@ -354,8 +757,11 @@ Document content:
             'full_text': "Analysis failed"
         }
     
-    def generate_word_summary(self, analyses: List[Dict[str, Any]]) -> str:
-        """Generate Word document summary"""
+    def generate_word_summary(self, batch: AnalysisBatch) -> io.BytesIO:
+        """Generate Word document summary as an in-memory .docx"""
+        from docx import Document as DocxDocument
+        from docx.enum.text import WD_ALIGN_PARAGRAPH
+        
         doc = DocxDocument()
         
         # Title
@@ -365,17 +771,14 @@ Document content:
         # Summary information
         doc.add_heading('Executive Summary', level=1)
         doc.add_paragraph(f'Analysis Date: {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}')
-        doc.add_paragraph(f'Total Files Analyzed: {len(analyses)}')
+        doc.add_paragraph(f'Total Files Analyzed: {len(batch)}')
         
         # Overall statistics
-        quote_ready_count = sum(1 for analysis in analyses if analysis['quote_ready'])
-        avg_risk_score = sum(analysis['risk_score'] for analysis in analyses) / len(analyses)
-        
-        doc.add_paragraph(f'Quote Ready Files: {quote_ready_count}/{len(analyses)}')
-        doc.add_paragraph(f'Average Risk Score: {avg_risk_score:.1f}%')
+        doc.add_paragraph(f'Quote Ready Files: {batch.quote_ready_count}/{len(batch)}')
+        doc.add_paragraph(f'Average Risk Score: {batch.avg_risk_score:.1f}%')
         
         # Individual file analyses
-        for i, analysis in enumerate(analyses, 1):
+        for i, analysis in enumerate(batch.to_dicts(), 1):
             doc.add_page_break()
             doc.add_heading(f'Analysis {i}: {analysis["file_name"]}', level=1)
             
@@ -404,16 +807,19 @@ Document content:
                     doc.add_paragraph(content)
         
         # Save document
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"Quote_Analysis_Report_{timestamp}.docx"
-        filepath = OUTPUT_DIR / filename
-        doc.save(str(filepath))
+        buffer = io.BytesIO()
+        doc.save(buffer)
+        buffer.seek(0)
+        
+        if SAVE_REPORTS_TO_DISK:
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            (OUTPUT_DIR / f"Quote_Analysis_Report_{timestamp}.docx").write_bytes(buffer.getvalue())
         
-        return str(filepath)
+        return buffer
     
     def setup_rag_for_documents(self, texts: List[str]):
         """Setup RAG vector store for uploaded documents"""
-        if not RAG_AVAILABLE:
+        if not self._ensure_rag():
             return False
             
         try:
@@ -423,23 +829,114 @@ Document content:
                 chunks = self.text_splitter.split_text(text)
                 all_chunks.extend(chunks)
             
-            # Create vector store
-            self.vector_store = FAISS.from_texts(all_chunks, self.embeddings)
+            # Create vector store from cached embeddings where available
+            vectors = self._embed_chunks_cached(all_chunks)
+            
+            # Small corpora are searched with a NumPy dot product; FAISS only pays off at scale
+            if len(all_chunks) < NUMPY_SEARCH_MAX_CHUNKS:
+                self._chunk_matrix = self._build_chunk_matrix(vectors)
+                self._chunks = all_chunks
+                self.vector_store = None
+            else:
+                self.vector_store = self._build_hnsw_store(all_chunks, vectors)
+                self._chunk_matrix = None
+                self._chunks = []
             return True
             
         except Exception as e:
             st.error(f"Failed to setup RAG: {e}")
             return False
     
+    def _build_chunk_matrix(self, vectors):
+        """Stack unit-normalised float32 embeddings so a dot product gives cosine similarity"""
+        import numpy as np
+        
+        matrix = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        # float32 keeps the query a single BLAS matrix-vector product; <5000 x 384 is ~7 MB
+        return matrix / np.maximum(norms, 1e-12)
+    
+    def _retrieve_context(self, question: str, k: int = 3) -> List[str]:
+        """Return the k chunks most similar to the question"""
+        if self._chunk_matrix is None:
+            return [doc.page_content for doc in self.vector_store.similarity_search(question, k=k)]
+        
+        import numpy as np
+        
+        query = np.asarray(self.embeddings.embed_query(question), dtype=np.float32)
+        query /= max(np.linalg.norm(query), 1e-12)
+        scores = self._chunk_matrix @ query
+        
+        if len(scores) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(len(scores))
+        top = top[np.argsort(-scores[top])]
+        return [self._chunks[i] for i in top]
+    
+    def _build_hnsw_store(self, chunks: List[str], vectors):
+        """Wrap an HNSW FAISS index in a LangChain vector store"""
+        import faiss
+        import numpy as np
+        from langchain.docstore.document import Document as LangchainDocument
+        from langchain.docstore.in_memory import InMemoryDocstore
+        from langchain.vectorstores import FAISS
+        
+        matrix = np.asarray(vectors, dtype="float32")
+        index = faiss.IndexHNSWFlat(matrix.shape[1], HNSW_NEIGHBORS)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+        index.add(matrix)
+        
+        ids = [str(i) for i in range(len(chunks))]
+        docstore = InMemoryDocstore({
+            doc_id: LangchainDocument(page_content=chunk)
+            for doc_id, chunk in zip(ids, chunks)
+        })
+        return FAISS(
+            embedding_function=self.embeddings.embed_query,
+            index=index,
+            docstore=docstore,
+            index_to_docstore_id=dict(enumerate(ids))
+        )
+    
+    def _embed_chunks_cached(self, chunks: List[str]):
+        """Embed chunks as a float32 matrix, reusing vectors persisted on disk by chunk hash"""
+        import numpy as np
+        
+        # Vectors differ between models, so the model id is part of the key;
+        # the suffix keeps normalised vectors apart from older unnormalised entries
+        prefix = self.embedding_model_id + ":normalized\0"
+        keys = [hashlib.sha1((prefix + chunk).encode("utf-8")).hexdigest() for chunk in chunks]
+        
+        # Vectors are stored as raw float32 bytes: compact and no pickling
+        cache = _load_embedding_cache()
+        vectors = {}
+        for key in set(keys):
+            raw = cache.get(key)
+            if raw is not None:
+                vectors[key] = np.frombuffer(raw, dtype=np.float32)
+        
+        # Embed all cache misses in a single batch
+        missing = {key: chunk for key, chunk in zip(keys, chunks) if key not in vectors}
+        if missing:
+            new_vectors = np.asarray(
+                self.embeddings.embed_documents(list(missing.values())), dtype=np.float32
+            )
+            for key, vector in zip(missing.keys(), new_vectors):
+                cache.set(key, vector.tobytes())
+                vectors[key] = vector
+        
+        return np.stack([vectors[key] for key in keys])
+    
     def chat_with_documents(self, question: str) -> str:
         """Chat with uploaded documents using RAG"""
-        if not RAG_AVAILABLE or not self.vector_store:
+        if not self._ensure_rag() or (self.vector_store is None and self._chunk_matrix is None):
             return "RAG not available. Please upload documents first."
         
         try:
             # Retrieve relevant documents
-            docs = self.vector_store.similarity_search(question, k=3)
-            context = "\n".join([doc.page_content for doc in docs])
+            context = "\n".join(self._retrieve_context(question, k=3))
             
             # Generate response using context
             prompt = f"""
@@ -493,16 +990,28 @@ def main():
             analyses = []
             extracted_texts = []
             
-            for uploaded_file in uploaded_files:
-                # Extract text
-                text = assistant.extract_text_from_file(uploaded_file)
-                if text:
-                    extracted_texts.append(text)
-                    # Analyze with AI
-                    analysis = assistant.analyze_quote_text(text, uploaded_file.name)
-                    analyses.append(analysis)
+            # Extract and analyze files concurrently; render results on the main thread
+            results = assistant.process_files(uploaded_files)
+            
+            # Keep upload order for display
+            for status, payload in results:
+                if status == "error":
+                    st.error(payload)
+                    continue
+                if status == "skip":
+                    continue
+                
+                text, analysis, message = payload
+                if status == "analysis_error":
+                    st.error(message)
+                elif status == "warning":
+                    st.warning(message)
+                extracted_texts.append(text)
+                analyses.append(analysis)
         
         if analyses:
+            batch = AnalysisBatch(analyses)
+            
             # Display results
             st.header("Analysis Results")
             
@@ -510,29 +1019,27 @@ def main():
             col1, col2, col3, col4 = st.columns(4)
             
             with col1:
-                st.metric("Files Analyzed", len(analyses))
+                st.metric("Files Analyzed", len(batch))
             
             with col2:
-                quote_ready = sum(1 for a in analyses if a['quote_ready'])
-                st.metric("Quote Ready", f"{quote_ready}/{len(analyses)}")
+                st.metric("Quote Ready", f"{batch.quote_ready_count}/{len(batch)}")
             
             with col3:
-                avg_risk = sum(a['risk_score'] for a in analyses) / len(analyses)
-                st.metric("Avg Risk Score", f"{avg_risk:.1f}%")
+                st.metric("Avg Risk Score", f"{batch.avg_risk_score:.1f}%")
             
             with col4:
                 if st.button("Generate Report"):
                     with st.spinner("Generating Word report..."):
-                        report_path = assistant.generate_word_summary(analyses)
+                        report = assistant.generate_word_summary(batch)
                         
                     # Provide download
-                    with open(report_path, "rb") as file:
-                        st.download_button(
-                            label="Download Report",
-                            data=file.read(),
-                            file_name=os.path.basename(report_path),
-                            mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document"
-                        )
+                    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+                    st.download_button(
+                        label="Download Report",
+                        data=report.getvalue(),
+                        file_name=f"Quote_Analysis_Report_{timestamp}.docx",
+                        mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+                    )
             
             # Individual analysis results
             for i, analysis in enumerate(analyses):
@@ -569,14 +1076,9 @@ def main():
                             st.subheader(section_title)
                             st.write(content)
             
-            # Setup RAG for chat
+            # Document chat; the RAG index is only built once a question is asked
             if RAG_AVAILABLE and extracted_texts:
-                if 'rag_setup' not in st.session_state:
-                    with st.spinner("Setting up document chat..."):
-                        rag_success = assistant.setup_rag_for_documents(extracted_texts)
-                        st.session_state.rag_setup = rag_success
-                
-                if st.session_state.rag_setup:
+                if st.session_state.get('rag_setup', True):
                     # Chat interface
                     st.header("Chat with Documents")
                     st.markdown("Ask questions about your uploaded documents")
@@ -588,6 +1090,11 @@ def main():
                     user_question = st.text_input("Ask a question about your documents:")
                     
                     if user_question:
+                        if 'rag_setup' not in st.session_state:
+                            with st.spinner("Setting up document chat..."):
+                                rag_success = assistant.setup_rag_for_documents(extracted_texts)
+                                st.session_state.rag_setup = rag_success
+                        
                         with st.spinner("Thinking..."):
                             response = assistant.chat_with_documents(user_question)
                         